@@ -13,15 +13,18 @@ FORMATION_SIZE   = 3
 HAND_SIZE        = 7
 EPSILON          = 0.1 # Arbitrary number on (0,1) to break formation ties
 POKER_HIERARCHY  = ('straight flush', 'triple', 'flush', 'straight', 'sum')
+POKER_RANK       = {fType: i for i, fType in enumerate(POKER_HIERARCHY)}
 TROOP_SUITS      = 'roygbp'
 TROOP_CONTENTS   = '0123456789' # 0 is lowest.
+SUIT_SHIFT       = 4   # Troop cards are ints: (suit << SUIT_SHIFT) | value
+VALUE_MASK       = 0xF # See encode and decode (bot_utils.py).
 TACTICS          = {'Al':'Alexander',      'Co':'Companion Cavalry',
                     'Da':'Darius',         'De':'Deserter',
                     'Fo':'Fog',            'Mu':'Mud',
                     'Re':'Redeploy',       'Sc':'Scout',
                     'Sh':'Shield Bearers', 'Tr':'Traitor'}
 
-import random, sys, copy, itertools
+import random, sys, itertools, functools, collections
 from bot_utils import *
 
 class Player():
@@ -41,9 +44,10 @@ class Player():
     def play(self, r):
         """Override to submit a move on your player's turn.
         
-        If playing a troop card, return a 3-tuple of the card name, the flag
-        number where it should be played, and a deck to draw from.  Playing a
-        tactics card is more complicated; see Round.play_tactics."""
+        If playing a troop card, return a 3-tuple of the card (an int; see
+        encode in bot_utils.py), the flag number where it should be played, and
+        a deck to draw from.  Playing a tactics card is more complicated; see
+        Round.play_tactics."""
 
         raise Exception('Must override this method')
 
@@ -51,55 +55,79 @@ class Player():
         """Override to return a list of two discards after playing Scout."""
         raise Exception('Must override this method')
 
+    tt = None # See set_tt.
+
+    @classmethod
+    def set_tt(cls, tt):
+        """Receive a TranspositionTable (see bot_utils.py) kept across rounds.
+
+        Called once per process, before any round; search-based players can
+        look up and store positions in self.tt."""
+        cls.tt = tt
+
 
 class Round():
     """Store round info and interact with AI players.
 
     Methods that interact with AIs: 'get_play', 'get_scout_discards'
 
-    Formation dicts are explained in 'detect_formation' (bot_utils.py).
+    Formations are explained in the Formation class (bot_utils.py).
 
-    best & bestMud (dict): Best formation reachable at an empty flag
+    best & bestMud (Formation): Best formation reachable at an empty flag
     flags (list of 9 Flag): See Flag class
-    h (list of 2 Hand): See Hand class
+    h (tuple of 2 Hand): See Hand class
     playedLeader (int or None): Who (player 0 or 1) played Alexander or Darius
     tacticsAdvantage (int or None): Who has played fewer tactics cards
     winner (int or None): Who won the round
     whoseTurn (int): Current player
     verbose (bool): Whether to print play-by-play output (or just state winner)
-    cardsLeft (dict): Lists of cards publicly remaining in each deck
+    cardsLeft (dict): Sets of cards publicly remaining in each deck (tactics)
+    cardsLeftMask (int): Troop cards publicly remaining, as bits (1 << card)
+    valuesLeft & suitsLeft (list of int): How many of those troops remain of
+                                          each value and of each suit
     decks (dict): Lists of ordered draw piles for each deck (don't cheat!)
     """
 
     def __init__(self, players, names, verbose):
         """Instantiate a Round and its Flag and Hand sub-objects."""
-        initialBest = detect_formation(
-                 [v+TROOP_SUITS[0] for v in TROOP_CONTENTS[-3:]]) # Red 7, 8, 9
-        self.best = initialBest
-        initialBestMud = detect_formation(
-                 [v+TROOP_SUITS[0] for v in TROOP_CONTENTS[-4:]]) # Red 6-9
-        self.bestMud = initialBestMud
-        self.flags = [self.Flag(initialBest) for i in range(N_FLAGS)]
-
-        self.h = [self.Hand(i, names[i]) for i in range(N_PLAYERS)]
+        self.flags = [self.Flag(None) for i in range(N_FLAGS)]
+        self.h = tuple(self.Hand(i, names[i]) for i in range(N_PLAYERS))
+        self.verbose = verbose
+        self._bestCaseCache = {}
+        self.reset()
+
+    def reset(self):
+        """Clear the board and hands so this Round can be played again."""
+        self.best = INITIAL_BEST
+        self.bestMud = INITIAL_BEST_MUD
+        for flag in self.flags:
+            flag.reset(INITIAL_BEST)
+        for hand in self.h:
+            hand.cards.clear()
 
         self.playedLeader = None
         self.tacticsAdvantage = None
         self.winner = None
         self.whoseTurn = 0
-        self.verbose = verbose
+        self._bestCaseCache.clear()
+        self._troopsLeftDesc, self._troopsLeftDescMask = [], None
 
     def generate_decks_and_deal_hands(self):
         """Construct decks, shuffle, and deal."""
-        troopDeck = [n + s for n in TROOP_CONTENTS for s in TROOP_SUITS]
-        tacticsDeck = [key for key in TACTICS]
+        troopDeck = list(TROOP_DECK)
+        tacticsDeck = list(TACTICS)
 
-        self.cardsLeft = {'troop':troopDeck[:], 'tactics':tacticsDeck[:]}
+        self.cardsLeft = {'tactics':set(tacticsDeck)}
+        self.cardsLeftMask = ALL_TROOPS
+        self.valuesLeft = [len(TROOP_SUITS)] * len(TROOP_CONTENTS)
+        self.suitsLeft = [len(TROOP_CONTENTS)] * len(TROOP_SUITS)
 
         [random.shuffle(d) for d in (troopDeck, tacticsDeck)]
         self.decks = {'troop':troopDeck, 'tactics':tacticsDeck}
 
-        [h.add(self.draw('troop')) for h in self.h for i in range(HAND_SIZE)]
+        for h in self.h: # Deal in bulk, as if drawing one card at a time.
+            h.cards.extend(reversed(troopDeck[-HAND_SIZE:]))
+            del troopDeck[-HAND_SIZE:]
 
     def draw(self, deckName):
         """Attempt to remove and return the top card of a deck."""
@@ -144,7 +172,10 @@ class Round():
             self.play_tactics(card, target)
             self.update_tactics_advantage()
         else: # Troop
-            self.cardsLeft['troop'].remove(card)
+            assert self.still_available(card)
+            self.cardsLeftMask &= ~(1 << card)
+            self.valuesLeft[card & VALUE_MASK] -= 1
+            self.suitsLeft[card >> SUIT_SHIFT] -= 1
             self.play_troop(card, target)
 
         if card == 'Sc':
@@ -155,6 +186,10 @@ class Round():
 
         return card, target, deckName
 
+    def still_available(self, card):
+        """Check whether a troop card has not been played yet."""
+        return (self.cardsLeftMask >> card) & 1 == 1
+
     def get_scout_discards(self, player):
         """Process and return AI's discards (after Scout)."""
         discards = player.scout_discards(self)
@@ -255,7 +290,7 @@ class Round():
             return self.best_fog(cards, formationSize)
 
         if len(cards) == formationSize:
-            return detect_formation(cards)
+            return detect_formation_no_wilds(cards)
 
         if cards == []:
             if 'mud' in special:
@@ -263,58 +298,38 @@ class Round():
             else:
                 return self.best
 
-        firstValue, firstSuit = cards[0]
-        straight, triple, flush = check_formation_components(cards, formationSize)
-
-        if straight:
-            possibleStraights = possible_straights(cards, formationSize)
-
-            if flush:
-                for s in possibleStraights:
-                    for value in s:
-                        card = value + firstSuit
-                        if card not in self.cardsLeft['troop']:
-                            break
-                    else:
-                        return detect_formation(cards +\
-                                 [value + firstSuit for value in s])
-
-        if triple:
-            formation = copy.copy(cards)
-            for card in self.cardsLeft['troop']:
-                if card[0] == firstValue:
-                    formation += [card]
-                    if len(formation) == formationSize:
-                        return detect_formation(formation)
-
-        if flush:
-            formation = copy.copy(cards)
-            for value in TROOP_CONTENTS[::-1]:
-                if value + firstSuit in self.cardsLeft['troop']:
-                    formation.append(value + firstSuit)
-                    if len(formation) == formationSize:
-                        return detect_formation(formation)
-
-        if straight:
-            for s in possibleStraights:
-                formation = copy.copy(cards)
-                for value in s:
-                    for card in self.cardsLeft['troop']:
-                        if card[0] == value: # Value is available.
-                            formation.append(card)
-                            break
-                    else: # Value is not available.
-                        break
-                else: # All values are available.
-                    return detect_formation(formation)
-
-        return self.best_fog(cards, formationSize) # Sum
+        # Results only change when a troop is played, so cache them per mask.
+        key = (tuple(sorted(cards)), formationSize, self.cardsLeftMask)
+        if key not in self._bestCaseCache:
+            self._bestCaseCache[key] = self.best_continuation(cards,
+                                                              formationSize)
+        return self._bestCaseCache[key]
+
+    def best_continuation(self, cards, formationSize):
+        """Search remaining troops for the best way to complete the cards."""
+        formation = complete_formation(cards, formationSize,
+                                       self.cardsLeftMask)
+        if formation == None: # Sum
+            return self.best_fog(cards, formationSize)
+        return formation
 
     def best_fog(self, cards, formationSize):
         """Same as best_case_no_wilds, but ignores formations."""
-        cardsLeft = sorted(self.cardsLeft['troop'], reverse=True) # Desc.
         nEmptySlots = formationSize - len(cards)
-        return detect_formation(cards + cardsLeft[:nEmptySlots])
+        return detect_formation_no_wilds(
+            cards + self.troops_left_desc()[:nEmptySlots])
+
+    def troops_left_desc(self):
+        """Return remaining troop cards in TROOPS_DESC order (see bot_utils).
+
+        The list is rebuilt only after cardsLeftMask changes; don't modify it.
+        """
+        if self._troopsLeftDescMask != self.cardsLeftMask:
+            mask = self.cardsLeftMask
+            self._troopsLeftDesc = [card for card in TROOPS_DESC
+                                    if mask >> card & 1]
+            self._troopsLeftDescMask = mask
+        return self._troopsLeftDesc
 
     def best_empty(self, mud=False): ### TODO: Loop through best_case instead?
         """Find best formation (self.best) still playable at an empty flag."""
@@ -326,27 +341,33 @@ class Round():
             oldBest = self.bestMud
             formationSize += 1
 
-        cardsLeft = sorted(self.cardsLeft['troop'], reverse=True) # Desc.
-        for fType in POKER_HIERARCHY[POKER_HIERARCHY.index(oldBest['type']):]:
+        cardsLeft = self.troops_left_desc()
+        for fType in POKER_HIERARCHY[oldBest.rank:]:
             if fType == 'sum':
                 return self.best_case(cardsLeft[:formationSize], special)
             
             if fType == 'flush':
-                bestSoFar = {'strength':0}
-                for card in cardsLeft:                         #     
-                    self.cardsLeft['troop'].remove(card)       # Card can't be
+                bestSoFar = None
+                for card in cardsLeft:
+                    if self.suitsLeft[card >> SUIT_SHIFT] < formationSize:
+                        continue # Too few of this suit left for a flush.
+                    self.cardsLeftMask ^= 1 << card            # Card can't be
                     bestCase = self.best_case([card], special) # played twice.
-                    self.cardsLeft['troop'].append(card)       #
-                    if bestCase['type'] == fType:
-                        if bestCase['strength'] > bestSoFar['strength']:
+                    self.cardsLeftMask ^= 1 << card            #
+                    if bestCase.type == fType:
+                        if bestSoFar == None or\
+                           bestCase.strength > bestSoFar.strength:
                             bestSoFar = bestCase
-                if bestSoFar['strength'] > 0:
+                if bestSoFar != None:
                     return bestSoFar
 
             ### TODO: Don't double-check same-valued triples, straights.
             for card in cardsLeft:
+                if fType == 'triple' and\
+                   self.valuesLeft[card & VALUE_MASK] < formationSize - 1:
+                    continue # Too few left for a triple (card is included).
                 bestCase = self.best_case([card], special)
-                if bestCase['type'] == fType:
+                if bestCase.type == fType:
                     return bestCase
 
     def update_flag(self, flag, justPlayed, forceUpdate=False):
@@ -356,34 +377,36 @@ class Round():
             formationSize += 1
 
         for p in range(N_PLAYERS):
-            if forceUpdate or (justPlayed in flag.best[p]['cards']) !=\
+            if forceUpdate or (justPlayed in flag.best[p].cards) !=\
                               (justPlayed in flag.played[p]):
                 flag.best[p] = self.best_case(flag.played[p], flag.special)
 
     def check_winner(self):
         """Check for a majority or breakthrough victory.  Return any winner."""
-        flagOutcomes = [f.winner for f in self.flags]
-
-        for player in range(N_PLAYERS):
-            if flagOutcomes.count(player) >= STANDARD_WIN:
-                return player
-
+        wins = [0] * N_PLAYERS
+        breakthroughWinner = None # A majority still takes precedence.
         breakthroughStreak = 0
         streakHolder = None
-        for i in range(N_FLAGS):
-            if flagOutcomes[i] != None:
-                if flagOutcomes[i] == streakHolder:
+        for f in self.flags:
+            w = f.winner
+            if w != None:
+                wins[w] += 1
+                if wins[w] >= STANDARD_WIN: # Only one player can get here.
+                    return w
+
+                if w == streakHolder:
                     breakthroughStreak += 1
-                    if breakthroughStreak == BREAKTHROUGH_WIN:
-                        return streakHolder
+                    if breakthroughStreak == BREAKTHROUGH_WIN and\
+                       breakthroughWinner == None:
+                        breakthroughWinner = w
                 else:
-                    streakHolder = flagOutcomes[i]
+                    streakHolder = w
                     breakthroughStreak = 1
             else:
                 breakthroughStreak = 0
                 streakHolder = None
 
-        return None
+        return breakthroughWinner
 
     def show_flags(self):
         """Jankily print the board state."""
@@ -420,7 +443,7 @@ class Round():
                         iLine = 8 + j
 
                     if j < len(flag.played[p]):
-                        lines[iLine] += flag.played[p][j] + ' ' * 5
+                        lines[iLine] += decode(flag.played[p][j]) + ' ' * 5
                     else:
                         lines[iLine] += ' ' * 7
 
@@ -438,15 +461,25 @@ class Round():
         """Track all cards played at one flag.
 
         played (list of 2 list): Troop-like cards played on each side
-        best (list of 2 dict): Best formation still achievable on each side
+        best (list of 2 Formation): Best formation still achievable per side
         special (list of str): Whether 'fog' or 'mud' is in play here
         winner (int or None): Who won the flag
         """
 
+        __slots__ = ('played', 'best', 'special', 'winner')
+
         def __init__(self, initialBest):
             self.played = [[], []]
-            self.best = [initialBest, initialBest]
+            self.best = [None, None]
             self.special = []
+            self.reset(initialBest)
+
+        def reset(self, initialBest):
+            """Clear the flag in place for a new round."""
+            for side in self.played:
+                side.clear()
+            self.best[:] = initialBest, initialBest
+            self.special.clear()
             self.winner = None
 
         def has_card(self, p):
@@ -467,7 +500,7 @@ class Round():
                 if 'mud' in self.special:
                     formationSize += 1
     
-                formations = copy.copy(self.played)
+                formations = self.played[:]
                 finishedPlayers = [p for p in range(N_PLAYERS)
                                    if len(formations[p]) == formationSize]
                 
@@ -477,9 +510,10 @@ class Round():
                 elif len(finishedPlayers) == 1: # One attacker seeks a proof.
                     for p in range(N_PLAYERS):
                         if p not in finishedPlayers: # Defender
-                            formations[p] = copy.copy(self.best[p])
                             # Tie goes to attacker since he finished first.
-                            formations[p]['strength'] -= EPSILON
+                            b = self.best[p]
+                            formations[p] = Formation(b.cards, b.type, b.rank,
+                                                      b.strength - EPSILON)
                             formations[1 - p] = self.best[1 - p]
                             if compare_formations(formations, whoseTurn) == 1 - p:
                                 self.winner = 1 - p # Attacker wins.
@@ -488,11 +522,14 @@ class Round():
     class Hand():
         """Manage one player's hand of cards.
 
-        cards (list of str): One str per card (e.g., '2r' is a red two)
+        cards (list of int or str): One int per troop card (see encode in
+                                    bot_utils.py) or str per tactics card
         seat (int): Player ID number (starting player is 0, other player is 1)
         name (str): Player name to show in output
         """
 
+        __slots__ = ('cards', 'seat', 'name')
+
         def __init__(self, seat, name):
             self.cards = []
             self.seat = seat
@@ -500,7 +537,7 @@ class Round():
 
         def show(self):
             """Print cards (verbose output only)."""
-            print(self.name + ': ' + ' '.join(self.cards))
+            print(self.name + ': ' + ' '.join(map(decode, self.cards)))
             return len(self.name + ': ')
 
         def add(self, newCard):
@@ -1,84 +1,146 @@
 #!/usr/bin/env python
 """Wrapper for playing more than one round of Battle Line."""
 
-import sys, argparse, logging, random, math
+import sys, argparse, random, math, os, functools
+from array import array
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from types import MappingProxyType
 from play_bl import play_one_round
-from bl_classes import Player
+from bl_classes import Player, Round
+from bot_utils import TranspositionTable
 from players import * ### TODO: Streamline.
 
-availablePlayers = {}
-for playerSubClass in Player.__subclasses__():
-    availablePlayers[playerSubClass.get_name()] = playerSubClass
-
-# Parse command-line args.
-parser = argparse.ArgumentParser(description='Process some integers.')
-parser.add_argument('declaredPlayers', metavar='player', type=str, nargs=2,
-    help=', '.join(availablePlayers.keys()))
-parser.add_argument('-n', '--n_rounds', default=1, metavar='n_rounds',
-    type=int, help='positive int')
-
-args = parser.parse_args()
-
-assert args.n_rounds > 0
-verbose = True
-if args.n_rounds > 1:
-    verbose = False
-
-def ratio(player,lst): ### TODO: Add stats.
-    return lst.count(names[player]) / len(lst)
-
-def std_err(player,lst):
-    p = ratio(player,lst)
-    q = 1-p
-    n = len(lst)
-    return math.sqrt(p*q / n)
-
-# Load players.
-players = []
-rawNames = args.declaredPlayers
-for i in range(len(rawNames)):
-    assert rawNames[i] in availablePlayers
-    players.append(availablePlayers[rawNames[i]](i))
-    rawNames[i] = rawNames[i].capitalize()
-
-# Resolve duplicate names by appending '1', '2', etc. as needed.
-names = []
-counters = {name : 0 for name in rawNames}
-for name in rawNames:
-    if rawNames.count(name) > 1:
-        counters[name] += 1
-        names.append(name + str(counters[name]))
-    else:
-        names.append(name)
-
-# Pad names for better verbose display.
-longestName = ''
-for name in names:
-    if len(name) > len(longestName):
-        longestName = name
-for i in range(len(names)):
-    while len(names[i]) < len(longestName):
-        names[i] += ' '
-
-# Play rounds.
-winners = []
-for i in range(args.n_rounds):
-    if verbose:
-        print('\n' + 'ROUND {}:'.format(i))
-    winners.append(play_one_round(players, names, verbose))
-    if not verbose:
-        print('Winner: ' + str(winners[-1]))
-
-
-# Print average scores.
-if not verbose:
-    print('')
-if len(winners) > 1: # Only print stats if there were multiple rounds.
-    if winners.count(names[0]) > winners.count(names[1]):
-        print('Winner: ' + names[0] + " " +str(ratio(0,winners)) + " +/- " + str(std_err(0,winners))[:5])
+SILENT, SCORES, VERBOSE = range(3) # Output levels; compare as ints.
+VERBOSITIES = {'silent':SILENT, 'scores':SCORES, 'verbose':VERBOSE}
+RESULT = 'Winner: {} ({} flags)\n' # Formatted with a name and a score
+FLUSH_EVERY = 256 # Result lines buffered between writes
+
+# Built once at import; read-only so every lookup sees the same registry.
+availablePlayers = MappingProxyType({
+    sys.intern(playerSubClass.get_name()): playerSubClass
+    for playerSubClass in Player.__subclasses__()})
+
+# One table per process, shared by every round (and player) played in it.
+transpositionTable = TranspositionTable()
+for playerSubClass in availablePlayers.values():
+    playerSubClass.set_tt(transpositionTable)
+
+Z_95 = 1.96 # Normal quantile for a two-sided 95% interval
+
+def win_rate(seat, winners):
+    """Return a player's wins, share of wins, and its Wilson 95% interval.
+
+    Unlike p +/- z * sqrt(p * (1 - p) / n), the Wilson interval stays
+    sensible for small batches and for shares near 0 or 1.
+    """
+    n = len(winners)
+    wins = winners.count(seat)
+    p = wins / n
+    zz = Z_95 * Z_95
+    center = (p + zz / (2 * n)) / (1 + zz / n)
+    halfWidth = Z_95 * math.sqrt(p * (1 - p) / n + zz / (4 * n * n)) /\
+                (1 + zz / n)
+    return wins, p, center - halfWidth, center + halfWidth
+
+reusedRound = None # Each process replays one Round rather than allocating.
+
+def play_silent_round(playerKeys, names, seed):
+    """Play a non-verbose round with fresh players (e.g., in a worker)."""
+    global reusedRound
+    players = [availablePlayers[key](i) for i, key in enumerate(playerKeys)]
+    if reusedRound == None:
+        reusedRound = Round(players, names, False)
+    return play_one_round(players, names, False, seed, reusedRound)
+
+def main():
+    # Parse command-line args.
+    parser = argparse.ArgumentParser(description='Process some integers.')
+    parser.add_argument('declaredPlayers', metavar='player', type=str,
+        nargs=2, help=', '.join(availablePlayers.keys()))
+    parser.add_argument('-n', '--n_rounds', default=1, metavar='n_rounds',
+        type=int, help='positive int')
+    parser.add_argument('-v', '--verbosity', choices=VERBOSITIES.keys(),
+        help='default: verbose for one round, otherwise scores')
+    parser.add_argument('-s', '--seed', metavar='seed', type=int,
+        help='replay the same rounds (default: random)')
+
+    args = parser.parse_args()
+
+    assert args.n_rounds > 0
+    if args.verbosity == None:
+        verbosity = VERBOSE if args.n_rounds == 1 else SCORES
     else:
-        print('Winner: ' + names[1] + " " +str(ratio(1,winners)) + " +/- " + str(std_err(1,winners))[:5])
+        verbosity = VERBOSITIES[args.verbosity]
+    verbose = verbosity >= VERBOSE
+
+    # Load players.
+    playerKeys = [sys.intern(key) for key in args.declaredPlayers]
+    rawNames = []
+    for key in playerKeys:
+        assert key in availablePlayers
+        rawNames.append(key.capitalize())
+
+    # Resolve duplicate names by appending '1', '2', etc. as needed.
+    names = []
+    totals, counters = Counter(rawNames), Counter()
+    for name in rawNames:
+        if totals[name] > 1:
+            counters[name] += 1
+            names.append(name + str(counters[name]))
+        else:
+            names.append(name)
+
+    # Pad names for better verbose display.
+    width = max(map(len, names), default=0)
+    names = [name.ljust(width) for name in names]
+
+    # Play rounds, each seeded from one master seed.
+    master = random.Random(args.seed)
+    seeds = [master.randrange(2**63) for i in range(args.n_rounds)]
+    winners = array('i', [0]) * args.n_rounds # Seats, filled in per round
+    scores = array('i', [0]) * args.n_rounds
+    if verbose: # Stay in this process so the play-by-play prints in order.
+        players = [availablePlayers[key](i)
+                   for i, key in enumerate(playerKeys)]
+        r = Round(players, names, verbose)
+        for i in range(args.n_rounds):
+            print('\n' + 'ROUND {}:'.format(i))
+            winners[i], scores[i] = play_one_round(players, names, verbose,
+                                                   seeds[i], r)
+    elif args.n_rounds == 1: # Not worth starting worker processes
+        winners[0], scores[0] = play_silent_round(playerKeys, names, seeds[0])
+        if verbosity >= SCORES:
+            sys.stdout.write(RESULT.format(names[winners[0]], scores[0]))
+    else: # Rounds are independent, so play them in parallel.
+        nWorkers = min(os.cpu_count() or 1, args.n_rounds)
+        chunkSize = max(1, args.n_rounds // (4 * nWorkers)) # Fewer round trips
+        lines = [] # Written every FLUSH_EVERY rounds, not once per round
+        with ProcessPoolExecutor(nWorkers) as executor:
+            for i, (winner, score) in enumerate(executor.map(
+                    functools.partial(play_silent_round, playerKeys, names),
+                    seeds, chunksize=chunkSize)):
+                winners[i], scores[i] = winner, score
+                if verbosity >= SCORES:
+                    lines.append(RESULT.format(names[winner], score))
+                    if len(lines) == FLUSH_EVERY:
+                        sys.stdout.write(''.join(lines))
+                        sys.stdout.flush()
+                        lines.clear()
+        sys.stdout.write(''.join(lines))
+
+    # Print average scores.
+    if verbosity == SCORES:
+        print('')
+    if len(winners) > 1: # Only print stats if there were multiple rounds.
+        rates = [win_rate(seat, winners) for seat in range(len(names))]
+        for name, (wins, p, low, high) in zip(names, rates):
+            print('{}: {} of {} rounds, {:.3f} (95% CI {:.3f} to {:.3f})'
+                  .format(name, wins, len(winners), p, low, high))
+        leader = 0 if rates[0][1] > rates[1][1] else 1
+        print('Winner: ' + names[leader])
+    elif verbosity != SCORES: # Still print score for single round
+        sys.stdout.write(RESULT.format(names[winners[0]], scores[0]))
 
- 
-elif verbose: # Still print score for silent single round
-    print('Winner: ' + winners[0])
+if __name__ == '__main__':
+    main()
@@ -5,43 +5,94 @@ will use it, however, then it doesn't belong here."""
 
 from bl_classes import * # Need to import?  Do it in bl_classes.py.
 
+def encode(card):
+    """Pack a card name (e.g., '2r') into an int: (suit << 4) | value.
+
+    Tactics cards are not packed; they keep their two-letter names.
+    """
+    if card in TACTICS:
+        return card
+    return (TROOP_SUITS.index(card[1]) << SUIT_SHIFT) | int(card[0])
+
+def decode(card):
+    """Return the printable name of a card (inverse of encode)."""
+    if card in TACTICS:
+        return card
+    return TROOP_CONTENTS[card & VALUE_MASK] + TROOP_SUITS[card >> SUIT_SHIFT]
+
+# Every troop card, in the order the deck is built before shuffling.
+TROOP_DECK = tuple(encode(v + s) for v in TROOP_CONTENTS for s in TROOP_SUITS)
+
+# Every troop card, highest value first.  Ties go by descending suit letter
+# (y, r, p, o, g, b), as when sorting card names; best_fog and best_empty take
+# the first cards that fit, so this order decides Fog and Mud results.
+TROOPS_DESC = tuple(sorted(TROOP_DECK, key=decode, reverse=True))
+
+# Sets of troop cards are stored as int bit masks, where card c is (1 << c).
+ALL_TROOPS     = sum(1 << card for card in TROOP_DECK)
+CARDS_OF_SUIT  = tuple(sum(1 << ((s << SUIT_SHIFT) | v)
+                           for v in range(len(TROOP_CONTENTS)))
+                       for s in range(len(TROOP_SUITS)))
+CARDS_OF_VALUE = tuple(sum(1 << ((s << SUIT_SHIFT) | v)
+                           for s in range(len(TROOP_SUITS)))
+                       for v in range(len(TROOP_CONTENTS)))
+
+# Straights as bit masks of values (1 << value), strongest first.
+STRAIGHT_MASKS = {size: tuple(((1 << size) - 1) << low for low in
+                              reversed(range(len(TROOP_CONTENTS) - size + 1)))
+                  for size in (FORMATION_SIZE, FORMATION_SIZE + 1)} # Mud
+
+def mask_cards(mask):
+    """Yield the set bits of a mask (e.g., cards), lowest first."""
+    while mask:
+        lowest = mask & -mask
+        yield lowest.bit_length() - 1
+        mask ^= lowest
+
+def popcount(mask):
+    """Return the number of set bits in a mask (e.g., cards left)."""
+    return bin(mask).count('1')
+
+def card_group_masks(cards):
+    """Return bit masks of the values (1 << value) and suits in a group."""
+    values, suits = 0, 0
+    for card in cards:
+        values |= 1 << (card & VALUE_MASK)
+        suits |= 1 << (card >> SUIT_SHIFT)
+    return values, suits
+
 def possible_straights(cards, formationSize=FORMATION_SIZE):
     """Return a seq of conceivable straight continuations."""
-    minVal, maxVal = int(TROOP_CONTENTS[0]), int(TROOP_CONTENTS[-1])
-    allStraights = [range(i, i + formationSize)
-                    for i in range(minVal, maxVal - formationSize + 2)]
-
-    cardValues = [int(card[0]) for card in cards]
+    playedValues = card_group_masks(cards)[0]
 
     out = []
-    for straight in allStraights:
-        for value in cardValues:
-            if value not in straight:
-                break
-        else:
-            possibleStraight = list(straight)
-            for value in set(cardValues): # Skip already played cards.
-                possibleStraight.remove(value)
-            out.append(list(map(str, possibleStraight)))
-
-    return list(reversed(out)) # Strongest first
+    for straight in STRAIGHT_MASKS[formationSize]: # Strongest first
+        if playedValues & ~straight == 0:
+            # Skip already played values.
+            out.append(list(mask_cards(straight & ~playedValues)))
+
+    return out
 
 def check_formation_components(cards, formationSize=FORMATION_SIZE):
     """Return whether the cards are on track for a straight/triple/flush."""
+    return _check_sorted_components(tuple(sorted(cards)), formationSize)
+
+@functools.lru_cache(maxsize=100000)
+def _check_sorted_components(cards, formationSize):
+    """Cached check_formation_components, keyed on a sorted tuple of cards."""
     straight, triple, flush = False, False, False
 
     l = len(cards)
     if l > 1:
-        values, suits = [c[0] for c in cards], [c[1] for c in cards]
-        values.sort()
+        values, suits = card_group_masks(cards)
 
-        spacing = [int(values[i+1]) - int(values[i]) for i in range(l-1)]
-        if spacing.count(0) == l-1:
+        if values & (values - 1) == 0: # One value
             triple = True
-        elif 0 not in spacing and sum(spacing) <= formationSize - 1:
-            straight = True
+        elif popcount(values) == l: # Distinct values; check their span.
+            lowest = (values & -values).bit_length() - 1
+            straight = values.bit_length() - 1 - lowest <= formationSize - 1
 
-        if suits.count(suits[0]) == l:
+        if suits & (suits - 1) == 0: # One suit
             flush = True
 
         return straight, triple, flush
@@ -49,31 +100,116 @@ def check_formation_components(cards, formationSize=FORMATION_SIZE):
     else: # With 0 or 1 cards played, all formations are still conceivable.
         return True, True, True
 
+def _check3(cards, formationSize):
+    """Same as check_formation_components, unrolled for three cards."""
+    c0, c1, c2 = cards
+    a, b, c = sorted((c0 & VALUE_MASK, c1 & VALUE_MASK, c2 & VALUE_MASK))
+    triple = a == c
+    straight = a < b < c and c - a < formationSize
+    flush = c0 >> SUIT_SHIFT == c1 >> SUIT_SHIFT == c2 >> SUIT_SHIFT
+    return straight, triple, flush
+
+def _check4(cards, formationSize):
+    """Same as check_formation_components, unrolled for four cards (Mud)."""
+    c0, c1, c2, c3 = cards
+    a, b, c, d = sorted((c0 & VALUE_MASK, c1 & VALUE_MASK,
+                         c2 & VALUE_MASK, c3 & VALUE_MASK))
+    triple = a == d
+    straight = a < b < c < d and d - a < formationSize
+    flush = c0 >> SUIT_SHIFT == c1 >> SUIT_SHIFT ==\
+            c2 >> SUIT_SHIFT == c3 >> SUIT_SHIFT
+    return straight, triple, flush
+
+def complete_formation(cards, formationSize, cardsLeftMask):
+    """Return the best non-sum formation that can complete a group of cards.
+
+    cardsLeftMask (int) holds the troops still available (see Round); return
+    None if no straight flush, triple, flush, or straight can be completed.
+    """
+    firstValue, firstSuit = cards[0] & VALUE_MASK, cards[0] >> SUIT_SHIFT
+    straight, triple, flush = check_formation_components(cards, formationSize)
+
+    if straight:
+        possibleStraights = possible_straights(cards, formationSize)
+
+        if flush:
+            for s in possibleStraights:
+                continuation = [(firstSuit << SUIT_SHIFT) | v for v in s]
+                needed = sum(1 << card for card in continuation)
+                if cardsLeftMask & needed == needed:
+                    return detect_formation_no_wilds(cards + continuation)
+
+    nEmptySlots = formationSize - len(cards)
+
+    if triple:
+        valueLeft = cardsLeftMask & CARDS_OF_VALUE[firstValue]
+        if popcount(valueLeft) >= nEmptySlots: # Else skip the search.
+            return detect_formation_no_wilds(
+                cards + list(mask_cards(valueLeft))[:nEmptySlots])
+
+    if flush:
+        suitLeft = cardsLeftMask & CARDS_OF_SUIT[firstSuit]
+        if popcount(suitLeft) >= nEmptySlots: # Else skip the search.
+            formation = cards[:]
+            while len(formation) < formationSize: # Highest value first
+                card = suitLeft.bit_length() - 1
+                suitLeft ^= 1 << card
+                formation.append(card)
+            return detect_formation_no_wilds(formation)
+
+    if straight:
+        for s in possibleStraights:
+            formation = cards[:]
+            for value in s:
+                valueLeft = cardsLeftMask & CARDS_OF_VALUE[value]
+                if not valueLeft: # Value is not available.
+                    break
+                formation.append((valueLeft & -valueLeft).bit_length() - 1)
+            else: # All values are available.
+                return detect_formation_no_wilds(formation)
+
+    return None # Sum
+
 def card_options(card):
     """Specify which values a wild tactics card can assume."""
     if card == 'Al' or card == 'Da':
-        numbers = TROOP_CONTENTS
+        numbers = range(len(TROOP_CONTENTS))
     elif card == 'Sh':
         numbers = [0, 1, 2]
     elif card == 'Co':
         numbers = [7]
     else:
         return [card] # Not a wild tactics card
-    return [str(number) + suit for number in numbers for suit in TROOP_SUITS]
+    return [(suit << SUIT_SHIFT) | number
+            for number in numbers for suit in range(len(TROOP_SUITS))]
 
-def detect_formation(cards):
-    """Return the strongest formation a complete set of cards achieves.
-    
-    A formation is stored in a dict keyed as follows.
-      'cards' (list): Cards that make up the formation
-      'type' (str): 'straight flush', 'triple', 'flush', 'straight', or 'sum'
-      'strength' (float): Three-digit int, where hundreds place indicates type
-                          and remaining digits indicate sum of card values;
-                          can be adjusted by EPSILON (float) to break a tie.
+class Formation():
+    """A complete group of cards, as returned by detect_formation.
+
+    Formations are cached, so treat them as read-only (copy before adjusting
+    strength).
+
+    cards (tuple): Cards that make up the formation, sorted
+    type (str): 'straight flush', 'triple', 'flush', 'straight', or 'sum'
+    rank (int): Index of type in POKER_HIERARCHY (0 is strongest)
+    strength (float): Three-digit int, where hundreds place indicates type and
+                      remaining digits indicate sum of card values; can be
+                      adjusted by EPSILON (float) to break a tie.
     """
-    l = len(cards)
-    assert FORMATION_SIZE <= l <= FORMATION_SIZE + 1 # Allow for Mud.
 
+    __slots__ = ('cards', 'type', 'rank', 'strength')
+
+    def __init__(self, cards, fType, rank, strength):
+        self.cards = cards
+        self.type = fType
+        self.rank = rank
+        self.strength = strength
+
+def detect_formation(cards):
+    """Return the strongest Formation a complete set of cards achieves.
+
+    Expects FORMATION_SIZE cards, or one more under Mud.
+    """
     cardOptions = list(itertools.product(*[card_options(c) for c in cards]))
     if len(cardOptions) == 1:
         return detect_formation_no_wilds(cards)
@@ -87,7 +223,18 @@ def detect_formation(cards):
 
 def detect_formation_no_wilds(cards):
     """Same as detect_formation, but assumes no wild tactics present."""
-    straight, triple, flush = check_formation_components(cards, len(cards))
+    return _detect_sorted_formation(tuple(sorted(cards)))
+
+@functools.lru_cache(maxsize=100000)
+def _detect_sorted_formation(cards):
+    """Cached detect_formation_no_wilds, keyed on a sorted tuple of cards.
+
+    Results are shared between callers; see Formation.
+    """
+    if len(cards) == FORMATION_SIZE:
+        straight, triple, flush = _check3(cards, FORMATION_SIZE)
+    else: # Mud
+        straight, triple, flush = _check4(cards, FORMATION_SIZE + 1)
 
     if straight and flush:
         fType = 'straight flush'
@@ -100,19 +247,26 @@ def detect_formation_no_wilds(cards):
     else:
         fType = 'sum'
 
-    formationTypeStrength = 100 * POKER_HIERARCHY[::-1].index(fType)
-    sumOfCardValues = sum([int(c[0]) for c in cards]) 
+    rank = POKER_RANK[fType]
+    formationTypeStrength = 100 * (len(POKER_HIERARCHY) - 1 - rank)
+    sumOfCardValues = sum(c & VALUE_MASK for c in cards)
 
-    return {'cards':cards,
-            'type':fType,
-            'strength':formationTypeStrength + sumOfCardValues}
+    return Formation(cards, fType, rank,
+                     formationTypeStrength + sumOfCardValues)
+
+# Best formations reachable at an empty flag before any card is played.
+INITIAL_BEST     = detect_formation([encode(v + TROOP_SUITS[0])
+                                     for v in TROOP_CONTENTS[-3:]]) # Red 7-9
+INITIAL_BEST_MUD = detect_formation([encode(v + TROOP_SUITS[0])
+                                     for v in TROOP_CONTENTS[-4:]]) # Red 6-9
 
 def compare_formations(formations, whoseTurn):
     """Return the player whose formation is stronger.  Account for ties."""
-    ranks = [POKER_HIERARCHY.index(f['type']) for f in formations]
-    strengths = [f['strength'] for f in formations]
-    if strengths[0] != strengths[1]:
-        return strengths.index(max(strengths))
+    f0, f1 = formations
+    if f0.rank != f1.rank: # Lower rank is higher in the hierarchy.
+        return 0 if f0.rank < f1.rank else 1
+    elif f0.strength != f1.strength:
+        return 0 if f0.strength > f1.strength else 1
     else: # Identical formations, but current player finished 2nd
         return 1 - whoseTurn
 
@@ -155,3 +309,95 @@ def is_playable(r, tacticsCard):
 
     if tacticsCard == 'Re':
         return myFull != []
+
+# Zobrist keys: one random 64-bit int per card per location, where locations
+# are the two hands (0 and 1), each side of each flag (see zobrist_hash), and
+# finally "not yet played" (troops in cardsLeftMask, tactics in cardsLeft).
+# Seeded separately so the keys, and any saved hashes, are the same every run.
+_zobristRandom = random.Random(0)
+N_LOCATIONS = N_PLAYERS * (N_FLAGS + 1) + 1
+ZOBRIST = {card: tuple(_zobristRandom.getrandbits(64)
+                       for location in range(N_LOCATIONS))
+           for card in TROOP_DECK + tuple(TACTICS)}
+# Per flag: one key for each special ('fog', 'mud') and each winner (0, 1)
+ZOBRIST_FLAG = tuple({state: _zobristRandom.getrandbits(64)
+                      for state in ('fog', 'mud') + tuple(range(N_PLAYERS))}
+                     for flag in range(N_FLAGS))
+ZOBRIST_LEADER    = tuple(_zobristRandom.getrandbits(64)    # playedLeader
+                          for p in range(N_PLAYERS))
+ZOBRIST_ADVANTAGE = tuple(_zobristRandom.getrandbits(64)    # tacticsAdvantage
+                          for p in range(N_PLAYERS))
+ZOBRIST_TURN = _zobristRandom.getrandbits(64) # XORed in on player 1's turn
+
+def zobrist_hash(r):
+    """Return a 64-bit hash of everything that decides the legal moves.
+
+    That is where every card is (a hand, a flag, unplayed, or otherwise gone,
+    e.g., deserted), each flag's specials and winner, playedLeader,
+    tacticsAdvantage, and whose turn it is.  A search can update it as it
+    moves a card instead of recomputing it:
+    h ^= ZOBRIST[card][old location] ^ ZOBRIST[card][new location].
+    Cards in hand are still unplayed, so playing one also XORs out
+    ZOBRIST[card][N_LOCATIONS - 1].
+    """
+    h = ZOBRIST_TURN if r.whoseTurn == 1 else 0
+    if r.playedLeader != None:
+        h ^= ZOBRIST_LEADER[r.playedLeader]
+    if r.tacticsAdvantage != None:
+        h ^= ZOBRIST_ADVANTAGE[r.tacticsAdvantage]
+
+    for p, hand in enumerate(r.h):
+        for card in hand.cards:
+            h ^= ZOBRIST[card][p]
+    for i, flag in enumerate(r.flags):
+        for p, side in enumerate(flag.played):
+            location = N_PLAYERS * (i + 1) + p
+            for card in side:
+                h ^= ZOBRIST[card][location]
+        for special in flag.special:
+            h ^= ZOBRIST_FLAG[i][special]
+        if flag.winner != None:
+            h ^= ZOBRIST_FLAG[i][flag.winner]
+
+    unplayed = N_LOCATIONS - 1
+    for card in mask_cards(r.cardsLeftMask):
+        h ^= ZOBRIST[card][unplayed]
+    for card in r.cardsLeft['tactics']:
+        h ^= ZOBRIST[card][unplayed]
+    return h
+
+class TranspositionTable():
+    """Search results keyed by zobrist_hash, kept across rounds.
+
+    Values are (depth, score, bound, move) tuples, where bound says whether
+    score is exact or a lower/upper bound.  Add entries only through store,
+    which caps the table at maxSize entries.
+    """
+
+    __slots__ = ('entries', 'maxSize')
+
+    def __init__(self, maxSize=10000000):
+        self.entries = collections.OrderedDict() # O(1) removal of oldest
+        self.maxSize = maxSize
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key):
+        """Return the entry for a position, or None if it isn't stored."""
+        return self.entries.get(key)
+
+    def store(self, key, depth, score, bound, move):
+        """Add an entry unless a deeper search of the position is stored.
+
+        Once full, evict the oldest entry.  Replacing an entry keeps its
+        place in line.
+        """
+        entries = self.entries
+        old = entries.get(key)
+        if old == None:
+            if len(entries) >= self.maxSize:
+                entries.popitem(last=False)
+        elif old[0] > depth:
+            return
+        entries[key] = depth, score, bound, move
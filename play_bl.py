@@ -7,9 +7,24 @@ module (bl_classes).
 
 from bl_classes import *
 
-def play_one_round(players, names, verbose):
-    """Play a full round and return the winner (str)."""
-    r = Round(players, names, verbose) # Instance of one Battle Line round
+def play_one_round(players, names, verbose, seed=None, r=None):
+    """Play a full round and return the winner and score (both int).
+
+    The winner is a seat, i.e., an index into players and names; the score
+    is the number of flags the winner took.
+
+    Pass a seed to make the round (the shuffle and any random choices the
+    players make) reproducible, independent of rounds played before it.
+    Pass a Round from an earlier call as r to reuse it instead of building
+    a new one.
+    """
+    if seed != None:
+        random.seed(seed)
+
+    if r == None:
+        r = Round(players, names, verbose) # Instance of one Battle Line round
+    else:
+        r.reset()
     r.generate_decks_and_deal_hands()
 
     while r.winner == None: # Take turns until game ends.
@@ -24,10 +39,10 @@ def play_one_round(players, names, verbose):
         else:
             card, target, deckName = play
 
-            if card in r.best['cards']:
+            if card in r.best.cards:
                 r.best = r.best_empty()
 
-            if card in r.bestMud['cards']:
+            if card in r.bestMud.cards:
                 r.bestMud = r.best_empty(True)
 
             for flag in r.flags:
@@ -37,10 +52,14 @@ def play_one_round(players, names, verbose):
             r.winner = r.check_winner()
 
             if verbose:
-                print(padLength * ' ' + 'Plays {} at {}'.format(card, target))
+                if card in ('De', 'Tr', 'Re'): # Target leads with a card.
+                    target = (decode(target[0]),) + tuple(target[1:])
+                print(padLength * ' ' + 'Plays {} at {}'.format(decode(card),
+                                                               target))
                 print(padLength * ' ' + 'Draws {}\n'.format(deckName))
                 r.show_flags()
 
         r.whoseTurn = 1 - r.whoseTurn
 
-    return r.h[r.winner].name
+    score = sum(flag.winner == r.winner for flag in r.flags)
+    return r.winner, score
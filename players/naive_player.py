@@ -29,7 +29,7 @@ class NaivePlayer(Player):
             for iFlag in playableFlags:
                 f = r.flags[iFlag]
                 candidate = [c] + f.played[me]
-                s = r.best_case_no_wilds(candidate, f.special)['strength']
+                s = r.best_case_no_wilds(candidate, f.special).strength
 
                 if s > bestFlagStrength:
                     bestFlagStrength = s
@@ -21,10 +21,10 @@ class OCDPlayer(Player):
             if card in TACTICS:
                 continue
 
-            if  TROOP_CONTENTS.index(card[0])  == 0:
+            if  card & VALUE_MASK  == 0:
                 continue
 
-            number = TROOP_CONTENTS.index(card[0])-1
+            number = (card & VALUE_MASK)-1
             if r.flags[number].has_slot(me):
                 flag = r.flags[number]
                 return card, number, r.prefer_deck('troop')
@@ -21,7 +21,7 @@ class RacistPlayer(Player):
             if card in TACTICS:
                 continue
 
-            color = TROOP_SUITS.index(card[1])
+            color = card >> SUIT_SHIFT
             if r.flags[color].has_slot(me):
                 flag = r.flags[color]
                 return card, color, r.prefer_deck('troop')